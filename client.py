@@ -1,32 +1,262 @@
 import asyncio
+import copy
+import functools
+import hashlib
+import io
 import json
 import os
-from contextlib import AsyncExitStack
-from typing import Any, List, Dict, Optional
+import re
+import sys
+import time
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Generic, List, Dict, Optional, Tuple, TypeVar, Union
 import httpx
 from dotenv import load_dotenv
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+try:
+    import orjson  # 可选依赖：安装后 JSON 编解码走 C 实现
+except ImportError:
+    orjson = None
+
+def _json_dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """把对象编码为 UTF-8 JSON 字节串。"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys).encode("utf-8")
+
+def _json_loads(data: Union[str, bytes]) -> Any:
+    """解析 JSON 字符串或字节串。"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# 用于从 LLM 的非严格输出中提取 JSON（例如被 markdown 代码块或说明文字包裹时）
+_JSON_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.DOTALL | re.IGNORECASE)
+_JSON_DECODER = json.JSONDecoder()
+
+def _extract_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """解析 LLM 的 JSON 输出：先直接解析，再尝试代码块内容，最后提取文本中第一个完整的 {...} 对象。"""
+    candidates = [text]
+    fence = _JSON_FENCE_RE.search(text)
+    if fence:
+        candidates.append(fence.group(1))
+    for candidate in candidates:
+        try:
+            parsed = _json_loads(candidate)
+        except ValueError:  # json.JSONDecodeError 和 orjson.JSONDecodeError 都是 ValueError 的子类
+            continue
+        if isinstance(parsed, dict):
+            return parsed
+    # raw_decode 在对象结束处停止，因此前后多余的文字或花括号不会影响解析
+    start = text.find("{")
+    while start != -1:
+        try:
+            parsed, _ = _JSON_DECODER.raw_decode(text, start)
+        except ValueError:
+            parsed = None
+        if isinstance(parsed, dict):
+            return parsed
+        start = text.find("{", start + 1)
+    return None
+
+class _JsonObjectScanner:
+    """增量扫描流式文本，判断最外层的 JSON 对象是否已经闭合（忽略字符串中的花括号）。"""
+    def __init__(self) -> None:
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> bool:
+        """输入一段新文本；最外层对象闭合时返回 True。"""
+        for ch in chunk:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = self._started
+            elif ch == "{":
+                self._depth += 1
+                self._started = True
+            elif ch == "}" and self._started:
+                self._depth -= 1
+                if self._depth == 0:
+                    return True
+        return False
+
+# _ainput 从 stdin 读到但尚未返回的字节（一次 os.read 可能包含多行）
+_STDIN_BUFFER = bytearray()
+
+async def _ainput(prompt: str) -> str:
+    """异步读取一行输入，等待期间不阻塞事件循环。
+
+    POSIX 上用 loop.add_reader 等 stdin 可读后再读取，不会有线程停在 input() 里，
+    Ctrl-C 时进程可以干净退出；Windows 或 stdin 不支持 add_reader（如普通文件）时退回线程池。
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        fd = sys.stdin.fileno()
+    except (AttributeError, ValueError, io.UnsupportedOperation):
+        fd = None
+    if os.name == "nt" or fd is None:
+        return await loop.run_in_executor(None, input, prompt)
+
+    print(prompt, end="", flush=True)
+    while b"\n" not in _STDIN_BUFFER:
+        readable = loop.create_future()
+        try:
+            loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+        except (PermissionError, NotImplementedError):
+            return await loop.run_in_executor(None, input, "")
+        try:
+            await readable
+        finally:
+            loop.remove_reader(fd)
+        chunk = os.read(fd, 4096)
+        if not chunk:
+            if not _STDIN_BUFFER:
+                raise EOFError
+            break  # 最后一行没有换行符
+        _STDIN_BUFFER.extend(chunk)
+    line, _, rest = bytes(_STDIN_BUFFER).partition(b"\n")
+    _STDIN_BUFFER[:] = rest
+    return line.decode(sys.stdin.encoding or "utf-8", errors="replace").rstrip("\r")
+
+# LLM 请求失败时返回的固定回复，调用方据此判断是否跳过后续步骤
+LLM_FAILURE_REPLY = "抱歉，我现在无法思考。"
+
+# 非交互入口从 MCP 连接池借用连接时的最长等待时间（秒），超时则报错而不是无限等待
+MCP_ACQUIRE_TIMEOUT = 10.0
+
+# MCP 返回内容的默认长度上限（字符数），防止把超大的输出整段塞进 LLM prompt
+MAX_TOOL_OUTPUT_CHARS = 50_000
+
+def _truncate(text: str, max_chars: int = MAX_TOOL_OUTPUT_CHARS) -> str:
+    """只保留前 max_chars 个字符，被截断时附加说明。"""
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + f"\n[Output truncated: showing first {max_chars} of {len(text)} characters.]"
+
+# 发送决策时给模型看的对话/回复预览长度（字符数），足以判断是否发送，又不必传入全文
+DECISION_PREVIEW_CHARS = 200
+
+# 发送决策的系统指令是固定文本，只构造一次
+_SYSTEM_PROMPT_DECISION = """
+你有一个可用的工具：
+- 工具名称: "sendWeChatTextMessage"
+- 工具描述: "发送一条文本消息到企业微信群。"
+
+回复内容由程序自动填入，你只需决定是否发送，并【仅】使用严格的 JSON 格式回复，不要包含任何其他文字或解释：
+- 发送：{"tool_call": {"name": "sendWeChatTextMessage", "arguments": {}}}
+- 不发送：{"tool_call": null}
+"""
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+class BatchBuffer(Generic[T, R]):
+    """把零散的请求攒成一批再统一处理：攒满 max_batch_size 条或等待超过 max_wait 秒即触发。"""
+    def __init__(
+        self,
+        processor: Callable[[List[T]], Awaitable[List[R]]],
+        max_batch_size: int = 8,
+        max_wait: float = 0.05,
+    ) -> None:
+        self._processor = processor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: List[Tuple[T, "asyncio.Future[R]"]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks: set["asyncio.Task[None]"] = set()
+
+    async def add(self, item: T) -> R:
+        """加入一条请求，并等待它所在批次的处理结果。"""
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[R]" = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._schedule_flush)
+        return await future
+
+    def _schedule_flush(self) -> None:
+        self._timer = None
+        task = asyncio.create_task(self.flush())
+        # 保留任务引用，避免被垃圾回收
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self) -> None:
+        """立即处理当前已缓冲的所有请求。"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            results = await self._processor([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"批处理结果数量不匹配: 期望 {len(batch)}，实际 {len(results)}")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+@functools.lru_cache(maxsize=1)
+def _load_env() -> None:
+    """从 .env 文件加载环境变量（整个进程只加载一次）。"""
+    load_dotenv()
+
+@functools.lru_cache(maxsize=None)
+def _read_server_config(file_path: str) -> dict[str, Any]:
+    with open(file_path, "rb") as f:
+        return _json_loads(f.read())
+
 class Configuration:
     """管理环境变量和服务器配置。"""
     def __init__(self) -> None:
-        load_dotenv()  # 从 .env 文件加载环境变量
+        _load_env()  # 从 .env 文件加载环境变量
         self.llm_api_key = os.getenv("LLM_API_KEY")
         self.wechat_webhook_key = os.getenv("WECHAT_WEBHOOK_KEY")
         self.wechat_chat_id = os.getenv("WECHAT_CHAT_ID")  # 可选的群聊ID
+        # LLM HTTP 连接池配置，可按 API 限流额度调整
+        self.llm_max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))
+        self.llm_max_keepalive = int(os.getenv("LLM_MAX_KEEPALIVE", "8"))
+        self.llm_timeout = float(os.getenv("LLM_TIMEOUT", "30.0"))
+        # 常驻的 MCP 服务器连接数量
+        self.mcp_pool_size = int(os.getenv("MCP_POOL_SIZE", "1"))
 
     @staticmethod
     def load_server_config(file_path: str) -> dict[str, Any]:
-        """从 JSON 文件加载 MCP 服务器的配置。"""
-        with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        """从 JSON 文件加载 MCP 服务器的配置（文件只读取一次，返回副本以免缓存被修改）。"""
+        return copy.deepcopy(_read_server_config(file_path))
 
 class McpServerConnection:
     """管理与 MCP 服务器的连接和通信。"""
     def __init__(self, name: str, config: dict[str, Any]) -> None:
         self.name = name
         self.config = config
+        # 子进程环境变量只合并一次，重复 initialize 时直接复用
+        self._env = {**os.environ, **self.config.get("env", {})}
         self.session: Optional[ClientSession] = None
         self.exit_stack = AsyncExitStack()
 #启动mcp server服务器
@@ -35,7 +265,7 @@ class McpServerConnection:
         server_params = StdioServerParameters(
             command=self.config["command"],
             args=self.config["args"],
-            env={**os.environ, **self.config.get("env", {})}
+            env=self._env
         )
         try:
             print(f"正在启动 MCP 服务器 '{self.name}'...")
@@ -56,8 +286,13 @@ class McpServerConnection:
             await self.cleanup()
             raise
 #获取提示模板
-    async def get_prompt_messages(self, prompt_name: str, arguments: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
-        """从 MCP 服务器获取一个格式化的 prompt 模板。"""
+    async def get_prompt_messages(
+        self,
+        prompt_name: str,
+        arguments: Dict[str, Any],
+        max_chars: int = MAX_TOOL_OUTPUT_CHARS,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """从 MCP 服务器获取一个格式化的 prompt 模板，每条消息最多保留 max_chars 个字符。"""
         if not self.session:
             raise RuntimeError(f"服务器 '{self.name}' 未连接。")
         try:
@@ -65,22 +300,27 @@ class McpServerConnection:
             response = await self.session.get_prompt(prompt_name, arguments)
             # 将 MCP 的消息格式转换为 LLM API 需要的简单字典列表格式
             return [
-                {"role": msg.role, "content": msg.content.text}
+                {"role": msg.role, "content": _truncate(msg.content.text, max_chars)}
                 for msg in response.messages
             ]
         except Exception as e:
             print(f"错误：获取 prompt '{prompt_name}' 失败: {e}")
             return None
 #调用工具
-    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Optional[str]:
-        """在 MCP 服务器上调用一个工具。"""
+    async def call_tool(
+        self,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        max_chars: int = MAX_TOOL_OUTPUT_CHARS,
+    ) -> Optional[str]:
+        """在 MCP 服务器上调用一个工具，返回最多 max_chars 个字符的输出。"""
         if not self.session:
             raise RuntimeError(f"服务器 '{self.name}' 未连接。")
         try:
             print(f"正在 MCP 服务器上调用工具 '{tool_name}'...")
             response = await self.session.call_tool(tool_name, arguments)
             # 假设工具的输出总是在第一个内容的文本部分
-            return response.content[0].text
+            return _truncate(response.content[0].text, max_chars)
         except Exception as e:
             print(f"错误：调用工具 '{tool_name}' 失败: {e}")
             return None
@@ -91,66 +331,350 @@ class McpServerConnection:
         await self.exit_stack.aclose()
         self.session = None
 
+class McpServerPool:
+    """维护若干个已初始化的 MCP 服务器连接，供调用方借用和归还，避免反复启动子进程。"""
+    def __init__(self, name: str, config: dict[str, Any], size: int = 2) -> None:
+        self.name = name
+        self.config = config
+        self.size = max(1, size)
+        self._connections: List[McpServerConnection] = []
+        self._idle: "asyncio.Queue[McpServerConnection]" = asyncio.Queue(maxsize=self.size)
+        self._init_lock = asyncio.Lock()
+
+    async def initialize(self) -> None:
+        """启动池中的所有 MCP 服务器连接。"""
+        async with self._init_lock:
+            if self._connections:
+                return
+            try:
+                # 逐个启动：每个连接的 exit stack 需要在同一个任务中进入和退出
+                for i in range(self.size):
+                    name = self.name if self.size == 1 else f"{self.name}-{i + 1}"
+                    connection = McpServerConnection(name=name, config=self.config)
+                    await connection.initialize()
+                    self._connections.append(connection)
+                    self._idle.put_nowait(connection)
+            except Exception:
+                await self.close()
+                raise
+
+    async def acquire(self, timeout: Optional[float] = None) -> McpServerConnection:
+        """借出一个空闲连接；timeout 秒内没有空闲连接时抛出 RuntimeError（None 表示一直等待）。
+
+        池必须先由负责关闭它的任务调用 initialize() 启动，这里不会隐式启动。
+        """
+        if not self._connections:
+            raise RuntimeError(f"MCP 连接池 '{self.name}' 尚未初始化。")
+        try:
+            return await asyncio.wait_for(self._idle.get(), timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(
+                f"MCP 连接池 '{self.name}' 在 {timeout} 秒内没有空闲连接（池大小 {self.size}），"
+                "可通过 MCP_POOL_SIZE 调大连接数。"
+            ) from None
+
+    def release(self, connection: McpServerConnection) -> None:
+        """归还之前借出的连接。"""
+        self._idle.put_nowait(connection)
+
+    @asynccontextmanager
+    async def connection(self, timeout: Optional[float] = None) -> AsyncIterator[McpServerConnection]:
+        """以 async with 的方式借用一个连接，结束时自动归还。"""
+        connection = await self.acquire(timeout)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    async def close(self) -> None:
+        """关闭池中的所有连接。"""
+        while not self._idle.empty():
+            self._idle.get_nowait()
+        connections, self._connections = self._connections, []
+        for connection in reversed(connections):
+            await connection.cleanup()
+
 class LLMInterface:
     """管理与 LLM API 的交互。"""
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        *,
+        limits: Optional[httpx.Limits] = None,
+        timeout: float = 30.0,
+        cache_size: int = 512,
+        cache_ttl: float = 300.0,
+    ):
         self.api_key = api_key
         self.base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+        # 复用同一个 httpx.AsyncClient，避免每轮对话都重新建立 TCP/TLS 连接，且不阻塞事件循环
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.api_key}",
+                "Accept-Encoding": "gzip",  # httpx 会自动解压
+            },
+            timeout=httpx.Timeout(timeout),
+            limits=limits or httpx.Limits(max_keepalive_connections=8, max_connections=16, keepalive_expiry=60.0),
+            # HTTP/2 让并发请求复用同一条 TCP/TLS 连接；未安装 h2 时退回 HTTP/1.1
+            http2=_HTTP2_AVAILABLE,
+        )
+        # 简单的 LRU 缓存：相同的请求参数在 TTL 内直接复用上次的回复
+        self._cache: "OrderedDict[bytes, tuple[str, float]]" = OrderedDict()
+        self._cache_max = cache_size
+        self._cache_ttl = cache_ttl
 
-    def get_llm_response(self, messages: List[Dict[str, str]], model: str = "qwen2.5-1.5b-instruct") -> str:
-        """向 LLM 发送消息并获取回复。"""
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}",
-        }
-        payload = {"model": model, "messages": messages}
+    @staticmethod
+    def _cache_key(payload: Dict[str, Any]) -> bytes:
+        return hashlib.blake2b(_json_dumps(payload, sort_keys=True), digest_size=16).digest()
+
+    def _cache_get(self, key: bytes) -> Optional[str]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        reply, stored_at = entry
+        if time.monotonic() - stored_at >= self._cache_ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return reply
+
+    def _cache_put(self, key: bytes, reply: str) -> None:
+        if self._cache_max <= 0:
+            return
+        self._cache[key] = (reply, time.monotonic())
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._cache_max:
+            self._cache.popitem(last=False)
+
+    async def get_llm_response(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = "qwen2.5-1.5b-instruct",
+        *,
+        json_mode: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        use_cache: bool = True,
+    ) -> str:
+        """向 LLM 发送消息并获取回复。
+
+        json_mode 为 True 时要求模型只输出 JSON 对象，适用于需要程序解析的请求；
+        temperature 为 None 时使用 API 的默认值。use_cache 为 False 时既不读取也不写入回复缓存。
+        """
+        payload: Dict[str, Any] = {"model": model, "messages": messages}
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        if temperature is not None:
+            payload["temperature"] = temperature
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+        key = self._cache_key(payload) if use_cache else None
+        if key is not None:
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
         try:
-            with httpx.Client(timeout=30.0) as client:
-                response = client.post(f"{self.base_url}/chat/completions", headers=headers, json=payload)
+            if json_mode:
+                # JSON 模式下流式读取，JSON 对象一闭合就停止，不必等待多余的生成内容
+                reply = await self._stream_json_completion(payload)
+            else:
+                response = await self._client.post("/chat/completions", content=_json_dumps(payload))
                 response.raise_for_status()  # 如果请求失败（如4xx或5xx错误），则抛出异常
-                data = response.json()
+                data = _json_loads(response.content)
                 # 直接从响应中提取助手的回复内容
-                return data["choices"][0]["message"]["content"]
+                reply = data["choices"][0]["message"]["content"]
+            if not isinstance(reply, str) or not reply.strip():
+                # 例如 API 返回 "content": null，视为请求失败，也不写入缓存
+                print("错误：LLM API 返回了空的回复内容。")
+                return LLM_FAILURE_REPLY
+            if key is not None:
+                self._cache_put(key, reply)  # 只缓存成功的回复
+            return reply
         except Exception as e:
             print(f"错误：请求 LLM API 失败: {e}")
-            return "抱歉，我现在无法思考。"
+            return LLM_FAILURE_REPLY
+
+    async def _stream_json_completion(self, payload: Dict[str, Any]) -> str:
+        """以 SSE 流式方式请求补全，在最外层 JSON 对象闭合时停止收集内容。
+
+        只有 HTTP/2 连接才会提前结束读取：HTTP/1.1 下未读完的响应会导致连接被关闭，
+        下一次请求又要重新握手，所以此时会把剩余事件读完以保留 keep-alive 连接。
+        """
+        scanner = _JsonObjectScanner()
+        parts: List[str] = []
+        complete = False
+        body = _json_dumps({**payload, "stream": True})
+        async with self._client.stream("POST", "/chat/completions", content=body) as response:
+            response.raise_for_status()
+            can_stop_early = response.http_version == "HTTP/2"
+            async for line in response.aiter_lines():
+                if complete:
+                    continue  # 只排空剩余事件，不再解析
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = _json_loads(data).get("choices") or []
+                delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                if not delta:
+                    continue
+                parts.append(delta)
+                if scanner.feed(delta):
+                    complete = True
+                    if can_stop_early:
+                        break
+        return "".join(parts)
+
+    async def get_llm_responses_batch(
+        self,
+        batched_messages: List[List[Dict[str, str]]],
+        model: str = "qwen2.5-1.5b-instruct",
+    ) -> List[str]:
+        """把多组独立的对话合并成一次 LLM 请求，按顺序返回每组的回复。
+
+        如果请求成功但模型没有按约定返回 N 条回复，则退回到逐条并发请求；
+        如果请求本身失败，则每项都返回 LLM_FAILURE_REPLY。
+        """
+        if not batched_messages:
+            return []
+        if len(batched_messages) == 1:
+            return [await self.get_llm_response(batched_messages[0], model=model)]
+        count = len(batched_messages)
+        tasks = "\n\n".join(
+            f"任务 {i + 1}:\n{_json_dumps(messages).decode('utf-8')}"
+            for i, messages in enumerate(batched_messages)
+        )
+        messages_for_batch = [
+            {
+                "role": "system",
+                "content": (
+                    f"你将收到 {count} 个相互独立的任务，每个任务是一组 JSON 格式的对话消息。"
+                    "请把每个任务当作单独的对话来完成，并【仅】使用以下 JSON 格式回复，不要包含任何其他文字：\n"
+                    '{"replies": [{"reply": "<任务 1 的回复>"}, {"reply": "<任务 2 的回复>"}]}\n'
+                    f"replies 数组必须恰好包含 {count} 项，且顺序与任务编号一致。"
+                ),
+            },
+            {"role": "user", "content": tasks},
+        ]
+        # 与逐条生成保持相同的 temperature（API 默认值），批量大小不应改变回复的风格
+        batch_str = await self.get_llm_response(messages_for_batch, model=model, json_mode=True, temperature=None)
+        if batch_str == LLM_FAILURE_REPLY:
+            # 请求本身失败（超时、5xx 等）时不再逐条重试，以免对故障中的接口再发 N 个请求
+            return [LLM_FAILURE_REPLY] * count
+        parsed = _extract_json_object(batch_str)
+        replies = parsed.get("replies") if parsed else None
+        if isinstance(replies, list) and len(replies) == count:
+            texts = [item.get("reply") if isinstance(item, dict) else item for item in replies]
+            if all(isinstance(text, str) and text for text in texts):
+                return texts
+        print("警告：批量回复格式不符合预期，改为逐条请求。")
+        return list(await asyncio.gather(
+            *(self.get_llm_response(messages, model=model) for messages in batched_messages)
+        ))
+
+    async def warmup(self) -> None:
+        """提前建立到 LLM API 的连接（TCP/TLS 握手），让第一轮对话不必承担这部分延迟。"""
+        try:
+            await self._client.head("/models")
+        except Exception as e:
+            print(f"警告：预热 LLM 连接失败: {e}")
+
+    async def aclose(self) -> None:
+        """关闭底层的 HTTP 连接池。"""
+        await self._client.aclose()
+
+    async def __aenter__(self) -> "LLMInterface":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
 
 class WeChatHumorBot:
     """协调 MCP 和 LLM 以生成幽默回复并发送到企业微信。"""
-    def __init__(self, mcp_server: McpServerConnection, llm_client: LLMInterface, config: Configuration):
-        self.mcp_server = mcp_server
+    def __init__(self, mcp_pool: McpServerPool, llm_client: LLMInterface, config: Configuration):
+        self.mcp_pool = mcp_pool
         self.llm_client = llm_client
         self.config = config
 
     def _get_system_prompt_for_llm_tool_decision(self) -> str:
         """这是一个特殊的“系统指令”，告诉 LLM 如何决定是否要调用工具。"""
-        return f"""
-你有一个可用的工具：
-- 工具名称: "sendWeChatTextMessage"
-- 工具描述: "发送一条文本消息到企业微信群。"
+        return _SYSTEM_PROMPT_DECISION
 
-如果你判断应该将生成的幽默回复发送出去，你必须【仅】使用以下严格的 JSON 格式进行回复，不要包含任何其他文字或解释：
-{{
-  "tool_call": {{
-    "name": "sendWeChatTextMessage",
-    "arguments": {{
-      "content": "<这里是你认为应该发送的幽默回复内容>"
-    }}
-  }}
-}}
-
-如果不想发送，就直接用普通文本回答，例如 "这次不发送"。
-"""
+    async def _get_humor_prompts(
+        self, mcp_server: McpServerConnection, dialogues: List[str]
+    ) -> List[Optional[List[Dict[str, Any]]]]:
+        """并发地为每段对话获取 humor prompt 模板。"""
+        return list(await asyncio.gather(*(
+            mcp_server.get_prompt_messages(
+                prompt_name="generateHumorousReply",
+                arguments={"dialogue": dialogue}
+            )
+            for dialogue in dialogues
+        )))
+
+    async def process_many(self, dialogues: List[str]) -> List[str]:
+        """非交互模式：并发处理多段对话，每段独立请求 LLM（不发送），结果顺序与输入一致。
+
+        需要从连接池借用一个 MCP 连接；与 start_chat 同时运行时连接池大小至少为 2，
+        否则等待 MCP_ACQUIRE_TIMEOUT 秒后抛出 RuntimeError。
+        """
+        async with self.mcp_pool.connection(timeout=MCP_ACQUIRE_TIMEOUT) as mcp_server:
+            prompts = await self._get_humor_prompts(mcp_server, dialogues)
+
+        async def _reply(prompt_messages: Optional[List[Dict[str, Any]]]) -> str:
+            if not prompt_messages:
+                return "抱歉，我今天没灵感了。"
+            return await self.llm_client.get_llm_response(messages=prompt_messages)
+
+        # 所有请求共享同一个 AsyncClient 连接池，并发量受连接池上限约束
+        return list(await asyncio.gather(*(_reply(p) for p in prompts)))
+
+    async def run_batch(self, dialogues: List[str], batch_size: int = 8) -> List[str]:
+        """非交互模式：为一组对话批量生成幽默回复（不发送），结果顺序与输入一致。
+
+        与 process_many 一样需要一个空闲的 MCP 连接，借用规则相同。
+        """
+        async with self.mcp_pool.connection(timeout=MCP_ACQUIRE_TIMEOUT) as mcp_server:
+            prompts = await self._get_humor_prompts(mcp_server, dialogues)
+
+        buffer: BatchBuffer[List[Dict[str, str]], str] = BatchBuffer(
+            self.llm_client.get_llm_responses_batch, max_batch_size=batch_size
+        )
+
+        async def _reply(prompt_messages: Optional[List[Dict[str, Any]]]) -> str:
+            if not prompt_messages:
+                return "抱歉，我今天没灵感了。"
+            return await buffer.add(prompt_messages)
+
+        return list(await asyncio.gather(*(_reply(p) for p in prompts)))
+
+    async def _prewarm(self, mcp_server: McpServerConnection) -> None:
+        """并发预热 LLM 的 HTTP 连接和 MCP 的 stdio 通道。"""
+        async def _warm_mcp() -> None:
+            if not mcp_server.session:
+                return
+            try:
+                await mcp_server.session.list_tools()
+            except Exception as e:
+                print(f"警告：预热 MCP 服务器失败: {e}")
+
+        await asyncio.gather(self.llm_client.warmup(), _warm_mcp())
 
     async def start_chat(self) -> None:
         """启动与用户的交互式聊天循环。"""
+        mcp_server: Optional[McpServerConnection] = None
         try:
-            await self.mcp_server.initialize()
+            mcp_server = await self.mcp_pool.acquire()
+            await self._prewarm(mcp_server)
             # 仅当配置了 webhook key 时，我们才认为发送工具可用
             send_tool_available = bool(self.config.wechat_webhook_key)
 
             while True:
-                user_dialogue = input("\n微信群聊对话内容 (输入 '退出' 来结束): ").strip()
+                # 异步读取输入，避免阻塞事件循环（MCP 会话和 HTTP 连接在等待期间仍能正常工作）
+                user_dialogue = (await _ainput("\n微信群聊对话内容 (输入 '退出' 来结束): ")).strip()
                 if user_dialogue.lower() in ["退出", "quit", "exit"]:
                     break
                 if not user_dialogue:
@@ -158,7 +682,7 @@ class WeChatHumorBot:
 
                 # --- 步骤 1: 使用 MCP Prompt 模板和 LLM 生成一个幽默回复 ---
                 print(">>> 步骤 1: 正在生成幽默回复...")
-                prompt_messages = await self.mcp_server.get_prompt_messages(
+                prompt_messages = await mcp_server.get_prompt_messages(
                     prompt_name="generateHumorousReply",
                     arguments={"dialogue": user_dialogue}
                 )
@@ -167,9 +691,13 @@ class WeChatHumorBot:
                     print("机器人: 抱歉，我今天没灵感了。")
                     continue
                 
-                humorous_reply = self.llm_client.get_llm_response(messages=prompt_messages)
+                humorous_reply = await self.llm_client.get_llm_response(messages=prompt_messages)
                 print(f"机器人(生成的回复): {humorous_reply}")
 
+                # 生成失败或回复为空时没有可发送的内容，无需再请求 LLM 做决策
+                if not humorous_reply or not humorous_reply.strip() or humorous_reply == LLM_FAILURE_REPLY:
+                    continue
+
                 # --- 步骤 2: 询问 LLM 是否应该将此回复发送到企业微信 ---
                 if not send_tool_available:
                     print("(提示: 未配置企业微信 Webhook Key，跳过发送步骤。)")
@@ -179,42 +707,51 @@ class WeChatHumorBot:
                 system_prompt = self._get_system_prompt_for_llm_tool_decision()
                 messages_for_decision = [
                     {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"我已经为对话“{user_dialogue}”生成了回复：“{humorous_reply}”。\n你认为应该发送吗？如果发送，请提供工具调用JSON。"}
+                    # 只附上对话和回复的前若干个字符供模型判断；实际发送的完整回复由程序注入工具参数
+                    {"role": "user", "content": (
+                        f"对话：“{user_dialogue[:DECISION_PREVIEW_CHARS]}”\n"
+                        f"回复：“{humorous_reply[:DECISION_PREVIEW_CHARS]}”\n"
+                        "请决定是否发送这条回复。"
+                    )}
                 ]
-                llm_decision_str = self.llm_client.get_llm_response(messages_for_decision)
+                llm_decision_str = await self.llm_client.get_llm_response(
+                    messages_for_decision, json_mode=True, temperature=0, max_tokens=64, use_cache=False
+                )
                 
                 # --- 步骤 3: 解析 LLM 的决定并执行工具 ---
-                try:
-                    # 尝试将 LLM 的回复解析为 JSON
-                    decision_json = json.loads(llm_decision_str)
-                    tool_call_data = decision_json.get("tool_call")
-
-                    if tool_call_data and tool_call_data.get("name") == "sendWeChatTextMessage":
-                        print(">>> 步骤 3: LLM 决定发送。正在调用工具...")
-                        tool_arguments = {
-                            "webhookKey": self.config.wechat_webhook_key,
-                            "content": humorous_reply,  # 使用我们自己生成的回复，更安全
-                        }
-                        # 如果配置了默认群聊ID，则添加
-                        if self.config.wechat_chat_id:
-                            tool_arguments["chatid"] = self.config.wechat_chat_id
-
-                        result = await self.mcp_server.call_tool(
-                            tool_name="sendWeChatTextMessage",
-                            arguments=tool_arguments
-                        )
-                        print(f"机器人: 消息已发送！(服务器响应: {result})")
-                    else:
-                        print("机器人: LLM 决定不发送消息。")
-
-                except (json.JSONDecodeError, AttributeError):
-                    # 如果 LLM 的回复不是我们期望的 JSON 格式，说明它不想调用工具
-                    print(f"机器人: LLM 决定不发送消息 (它的建议是: {llm_decision_str})")
+                decision_json = _extract_json_object(llm_decision_str)
+                if decision_json is None:
+                    # JSON 模式下模型应当总是返回 JSON；解析失败通常意味着输出被截断或请求出错
+                    print(f"警告：无法解析 LLM 的发送决策，本次不发送 (原始输出: {llm_decision_str})")
+                    continue
+
+                tool_call_data = decision_json.get("tool_call")
+                if isinstance(tool_call_data, dict) and tool_call_data.get("name") == "sendWeChatTextMessage":
+                    print(">>> 步骤 3: LLM 决定发送。正在调用工具...")
+                    tool_arguments = {
+                        "webhookKey": self.config.wechat_webhook_key,
+                        "content": humorous_reply,  # 使用我们自己生成的回复，更安全
+                    }
+                    # 如果配置了默认群聊ID，则添加
+                    if self.config.wechat_chat_id:
+                        tool_arguments["chatid"] = self.config.wechat_chat_id
+                    result = await mcp_server.call_tool(
+                        tool_name="sendWeChatTextMessage",
+                        arguments=tool_arguments
+                    )
+                    print(f"机器人: 消息已发送！(服务器响应: {result})")
+                else:
+                    print("机器人: LLM 决定不发送消息。")
 
         except KeyboardInterrupt:
             print("\n用户中断，正在退出...")
+        except asyncio.CancelledError:
+            # asyncio.run 收到 Ctrl-C 时会取消主任务；继续抛出，让调用方（wait_for、TaskGroup 等）知道任务被取消
+            print("\n聊天被中断，正在退出...")
+            raise
         finally:
-            await self.mcp_server.cleanup()
+            if mcp_server is not None:
+                self.mcp_pool.release(mcp_server)
 async def main() -> None:
     """主函数，负责设置和启动机器人。""" 
     # 初始化配置
@@ -226,14 +763,32 @@ async def main() -> None:
     # 我们只使用配置文件中的第一个 MCP 服务器
     server_name, server_conf = next(iter(server_configs["mcpServers"].items()))
     # 创建各个组件的实例
-    mcp_connection = McpServerConnection(name=server_name, config=server_conf)
-    llm_interface = LLMInterface(api_key=str(config.llm_api_key))
-    bot = WeChatHumorBot(mcp_server=mcp_connection, llm_client=llm_interface, config=config)
+    mcp_pool = McpServerPool(name=server_name, config=server_conf, size=config.mcp_pool_size)
+    llm_interface = LLMInterface(
+        api_key=str(config.llm_api_key),
+        limits=httpx.Limits(
+            max_connections=config.llm_max_connections,
+            max_keepalive_connections=config.llm_max_keepalive,
+            keepalive_expiry=60.0,
+        ),
+        timeout=config.llm_timeout,
+    )
+    bot = WeChatHumorBot(mcp_pool=mcp_pool, llm_client=llm_interface, config=config)
     # 启动聊天机器人
-    await bot.start_chat()
+    # LLM 客户端和 MCP 连接池都由 main() 持有，并在这里统一关闭
+    async with llm_interface:
+        try:
+            # 在 main() 的任务中显式启动连接池，保证每个连接的启动和关闭都在同一个任务中完成
+            await mcp_pool.initialize()
+            await bot.start_chat()
+        finally:
+            await mcp_pool.close()
 print("--- 机器人已关闭 ---")
 if __name__ == "__main__":
     # 在 Windows 上运行 asyncio 
     if os.name == 'nt':
         asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass  # Ctrl-C：清理已在 main() 中完成，不打印 traceback